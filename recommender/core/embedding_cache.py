@@ -0,0 +1,128 @@
+import atexit
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+
+import numpy as np
+
+"""
+Embedding Cache
+----------------------------------------------------
+Persistent text -> embedding cache so unchanged skill text is never
+re-encoded by the transformer model.
+
+Entries are keyed by the SHA-256 of the input text and kept in memory for
+lookups. New entries are written to SQLite by a background thread
+(write-behind) so request handlers never block on disk I/O.
+"""
+
+CACHE_DIR = "data"
+
+
+def text_key(text: str) -> str:
+    """Return the cache key for a piece of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, namespace: str, dimension: int = 768):
+        """
+        Initialize the cache and load existing entries from disk.
+
+        Args:
+            namespace (str): Identifies the model; each namespace has its own file
+            dimension (int): Dimension of the stored embeddings
+        """
+        self.dimension = dimension
+        self.path = os.path.join(CACHE_DIR, f"embeddings_{namespace}.sqlite")
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+
+        self.load()
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def get_many(self, texts: list[str]) -> list:
+        """
+        Look up embeddings for a list of texts.
+
+        Returns:
+            list: One entry per text, the cached vector or None on a miss
+        """
+        with self._lock:
+            return [self._entries.get(text_key(t)) for t in texts]
+
+    def put_many(self, texts: list[str], embeddings: np.ndarray):
+        """
+        Store embeddings in memory and queue them for persistence.
+
+        Args:
+            texts (list[str]): Input texts
+            embeddings (np.ndarray): Matrix of embeddings, one row per text
+        """
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, embeddings):
+                key = text_key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._entries[key] = vector
+                rows.append((key, vector.tobytes()))
+        if rows:
+            self._pending.put(rows)
+
+    def flush(self):
+        """Block until all queued entries are written to disk."""
+        self._pending.join()
+
+    def load(self):
+        """Load persisted entries into memory."""
+        if not os.path.exists(self.path):
+            return
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute("SELECT key, vector FROM embeddings").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            conn.close()
+        for key, blob in rows:
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if vector.shape[0] == self.dimension:
+                self._entries[key] = vector
+
+    def _write_loop(self):
+        """
+        Background writer, owns its own SQLite connection.
+
+        If the database cannot be opened the cache stays memory-only, but the
+        queue is still drained so flush() never waits on a dead writer.
+        """
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Embedding cache not persisted, cannot open {self.path}: {e}")
+            conn = None
+        while True:
+            rows = self._pending.get()
+            if conn is None:
+                self._pending.task_done()
+                continue
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Failed to persist embeddings: {e}")
+            finally:
+                self._pending.task_done()
@@ -9,6 +9,8 @@ warnings.filterwarnings(
 
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import torch
+from core.embedding_cache import EmbeddingCache
 
 """
 Embeddings Service
@@ -21,19 +23,133 @@ Uses a pre-trained model from HuggingFace.
 # 'all-mpnet-base-v2' is significantly better than MiniLM for semantic search
 # Dimension: 768
 MODEL_NAME = 'all-mpnet-base-v2'
+DIM = 768
+ENCODE_BATCH_SIZE = 64
+GPU_ENCODE_BATCH_SIZE = 256
+# Embeddings are unit-normalized; the namespace keeps older raw vectors out of the cache
+CACHE_NAMESPACE = f"{MODEL_NAME}-normalized"
 _model = None
+_forward = None # Compiled forward pass on GPU, otherwise the model itself
+_cache = None
 
 def get_model():
     """
     Lazy load the model to avoid startup crashes and timeouts.
     """
-    global _model
+    global _model, _forward
     if _model is None:
         print(f"Loading embedding model: {MODEL_NAME}...")
-        _model = SentenceTransformer(MODEL_NAME)
+        # Set up in a local and publish only when ready, so a failed load
+        # (e.g. a CUDA error) is retried by the next call
+        model = SentenceTransformer(MODEL_NAME)
+        # sentence-transformers 2.2.2 only moves the model inside encode(),
+        # which _encode() bypasses, so place it on its target device here
+        model.to(model._target_device)
+        forward = model
+        if torch.cuda.is_available():
+            # FP16 halves memory bandwidth of the forward pass on GPU
+            model.half()
+            forward = _compile(model)
+        _model, _forward = model, forward
         print("Model loaded successfully.")
     return _model
 
+def _compile(model):
+    """
+    Compile the forward pass into fused GPU kernels (torch >= 2.0).
+    Falls back to the eager model if compilation is unavailable.
+    
+    torch.compile is lazy, so a real forward pass is run here: missing
+    backends or graph breaks surface now instead of on the first request.
+    """
+    if not hasattr(torch, 'compile'):
+        return model
+    try:
+        # dynamic=True avoids a recompile for every padded sequence length
+        compiled = torch.compile(model, dynamic=True)
+        features = {
+            key: value.to(model._target_device)
+            for key, value in model.tokenize(["warmup"]).items()
+        }
+        with torch.inference_mode():
+            compiled(features)
+        return compiled
+    except Exception as e:
+        print(f"torch.compile unavailable, using eager model: {str(e)}")
+        return model
+
+def warmup():
+    """
+    Load the model and run a first forward pass so the first request
+    does not pay for weight loading and kernel initialization.
+    """
+    get_model()
+    generate_embedding("warmup")
+    if torch.cuda.is_available():
+        # A full batch primes the CUDA autotuner caches
+        _encode(["warmup"] * 8)
+    print("Embedding model warmed up.")
+
+def get_cache():
+    """
+    Lazy load the on-disk embedding cache for the current model.
+    """
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(CACHE_NAMESPACE, DIM)
+    return _cache
+
+def _encode(texts):
+    """
+    Run the model with the service-wide encode settings.
+    Returned vectors are float32 and L2-normalized (unit length).
+    
+    Equivalent to model.encode(..., normalize_embeddings=True), but runs under
+    torch.inference_mode() (no autograd bookkeeping at all) and, on GPU, copies
+    pinned token tensors to the device asynchronously.
+    
+    Texts are tokenized once, then batched in order of token length so each
+    batch is padded only to the length of similar texts, not the longest one.
+    """
+    single = isinstance(texts, str)
+    if single:
+        texts = [texts]
+    
+    model = get_model()
+    device = model._target_device
+    use_cuda = device.type == 'cuda'
+    
+    batch_size = GPU_ENCODE_BATCH_SIZE if use_cuda else ENCODE_BATCH_SIZE
+    
+    tokenizer = model.tokenizer
+    encoded = tokenizer(
+        [text.strip() for text in texts],
+        truncation=True,
+        max_length=model.max_seq_length
+    )
+    lengths = [len(ids) for ids in encoded['input_ids']]
+    order = np.argsort(lengths, kind='stable')
+    
+    embeddings = np.empty((len(texts), DIM), dtype=np.float32)
+    with torch.inference_mode():
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            batch = {key: [values[i] for i in batch_idx] for key, values in encoded.items()}
+            # Pad to the longest text in this length bucket only
+            features = dict(tokenizer.pad(batch, padding=True, return_tensors='pt'))
+            if use_cuda:
+                features = {
+                    key: value.pin_memory().to(device, non_blocking=True)
+                    for key, value in features.items()
+                }
+            # Runs transformer, pooling and any normalization modules in order
+            output = _forward(features)['sentence_embedding']
+            output = torch.nn.functional.normalize(output.float(), p=2, dim=1)
+            # Scatter back to the original input order
+            embeddings[batch_idx] = output.cpu().numpy()
+    
+    return embeddings[0] if single else embeddings
+
 def generate_embedding(text: str) -> np.ndarray:
     """
     Generate a vector embedding for a given text.
@@ -42,28 +158,42 @@ def generate_embedding(text: str) -> np.ndarray:
         text (str): The input text (e.g., "Python programming")
         
     Returns:
-        np.ndarray: A numpy array representing the vector embedding
+        np.ndarray: A numpy array representing the unit-length vector embedding
     """
+    # Degenerate input: answer without loading the model
+    text = text.strip() if text else ''
     if not text:
-        return np.zeros(768) # Dimension of all-mpnet-base-v2
+        return np.zeros(DIM, dtype=np.float32)
         
-    model = get_model()
-    embedding = model.encode(text)
+    embedding = _encode(text)
     return embedding
 
 def generate_embeddings(texts: list[str]) -> np.ndarray:
     """
     Generate embeddings for a list of texts (batch processing).
+    Texts already in the embedding cache are not re-encoded.
     
     Args:
         texts (list[str]): List of input texts
         
     Returns:
-        np.ndarray: Matrix of embeddings
+        np.ndarray: Matrix of unit-length embeddings
     """
     if not texts:
-        return np.array([])
+        # Keep the (n, DIM) shape so callers can stack/index it like any batch
+        return np.zeros((0, DIM), dtype=np.float32)
         
-    model = get_model()
-    embeddings = model.encode(texts)
+    cache = get_cache()
+    cached = cache.get_many(texts)
+    misses = [i for i, vector in enumerate(cached) if vector is None]
+    
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        encoded = _encode(miss_texts)
+        cache.put_many(miss_texts, encoded)
+        for i, vector in zip(misses, encoded):
+            cached[i] = vector
+    
+    # Stitch hits and freshly encoded vectors back in the original order
+    embeddings = np.vstack(cached).astype(np.float32)
     return embeddings
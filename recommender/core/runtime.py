@@ -0,0 +1,27 @@
+import os
+
+from dotenv import load_dotenv
+
+"""
+Runtime Settings
+----------------------------------------------------
+Thread budget shared by main.py (torch, OpenMP/BLAS and FAISS thread counts)
+and routers/recommend.py (request thread pool size).
+
+The router runs CPU-bound request work on WORKER_THREADS pool workers, and
+each worker gets an equal share of the cores for its library threads, so
+workers x threads per worker stays at about the number of cores.
+
+Import this before numpy, torch and faiss: OpenMP reads OMP_NUM_THREADS once.
+"""
+
+# Load the root .env (parent of the recommender directory) first, so values
+# set there apply to the settings below
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), '.env'))
+
+WORKER_THREADS = max(1, int(os.environ.get("RECOMMENDER_WORKER_THREADS", 2)))
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // WORKER_THREADS)
+
+# An explicit value in the environment or .env still wins
+os.environ.setdefault("OMP_NUM_THREADS", str(THREADS_PER_WORKER))
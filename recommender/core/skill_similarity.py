@@ -5,7 +5,10 @@ Calculates similarity between skills using Vector Embeddings (Sentence-Transform
 Replaces the old keyword/category based approach with semantic similarity.
 """
 
+import hashlib
+import threading
 import numpy as np
+from scipy.linalg.blas import ssyrk
 from typing import List, Dict, Any
 from core.embeddings import generate_embeddings
 from core.vector_store import VectorStore
@@ -24,6 +27,61 @@ class SkillSimilarityCalculator:
         """Initialize the similarity calculator."""
         self.vector_store = VectorStore()
         self.skill_embeddings = {} # Cache for embeddings
+        self._idx_to_skill = [] # Matrix index -> skill ID, built with the matrix
+        # Fingerprint of the skill set in the vector store, restored with it so a
+        # restart with the same skills does not re-embed and rebuild the index
+        self._fingerprint = self.vector_store.fingerprint
+        self._cached_matrix = None # Similarity matrix for that skill set
+        # Requests may run in worker threads; guards the indexed skill set
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def _skills_fingerprint(skills: List[Dict[str, Any]]) -> str:
+        """
+        Hash skill IDs and embedded text, in order.
+        
+        Order matters because matrix rows follow the order of `skills`.
+        """
+        digest = hashlib.blake2b()
+        for s in skills:
+            digest.update(f"{s.get('_id', '')}\0{s.get('name', '')} {s.get('description', '')}\0".encode())
+        return digest.hexdigest()
+    
+    def _embed_if_stale(self, skills: List[Dict[str, Any]], fingerprint: str):
+        """
+        Embed `skills` if the vector store holds a different skill set.
+        
+        Called without the lock held, so a cold-cache encode of the catalogue
+        does not block other requests. Returns None when nothing changed.
+        """
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return None
+        texts = [f"{s.get('name', '')} {s.get('description', '')}" for s in skills]
+        return generate_embeddings(texts)
+    
+    def _index_skills(self, skills: List[Dict[str, Any]], fingerprint: str,
+                      embeddings: np.ndarray = None):
+        """
+        Make the vector store hold exactly `skills`, unless it already does.
+        
+        Re-adding an unchanged skill set would only append duplicates, so the
+        store is reset and rebuilt only when the fingerprint changes.
+        Must be called with self._lock held; pass embeddings computed outside
+        the lock (see _embed_if_stale) so only the swap happens under it.
+        """
+        if fingerprint == self._fingerprint:
+            return
+        
+        if embeddings is None:
+            texts = [f"{s.get('name', '')} {s.get('description', '')}" for s in skills]
+            embeddings = generate_embeddings(texts)
+        
+        self.vector_store.reset()
+        self.vector_store.add_vectors([str(s.get('_id', '')) for s in skills], embeddings)
+        self.vector_store.fingerprint = fingerprint
+        self._fingerprint = fingerprint
+        self._cached_matrix = None
     
     def build_similarity_matrix(self, skills: List[Dict[str, Any]], 
                                user_skills_data: List[List[Dict[str, Any]]] = None) -> np.ndarray:
@@ -35,40 +93,45 @@ class SkillSimilarityCalculator:
             user_skills_data: Ignored in this version (embeddings handle semantics better)
             
         Returns:
-            Similarity matrix (n_skills x n_skills)
+            Similarity matrix (n_skills x n_skills), float32
         """
         n_skills = len(skills)
         if n_skills == 0:
             return np.array([])
+        
+        # Same skill set as last time: reuse the matrix
+        fingerprint = self._skills_fingerprint(skills)
+        with self._lock:
+            if fingerprint == self._fingerprint and self._cached_matrix is not None:
+                return self._cached_matrix
 
+        # Embedding and the matrix product run without the lock so concurrent
+        # requests are not serialized behind a cold-cache encode.
+        
         # 1. Extract text for embeddings (Name + Description)
         texts = [f"{s.get('name', '')} {s.get('description', '')}" for s in skills]
         
         # 2. Generate Embeddings (Batch)
-        embeddings = generate_embeddings(texts)
-        
-        # 3. Update Vector Store (for fast search)
-        # Add embedding to skill objects for VectorStore
-        skills_with_embeddings = []
-        for i, skill in enumerate(skills):
-            skill_copy = skill.copy()
-            skill_copy['embedding'] = embeddings[i]
-            skills_with_embeddings.append(skill_copy)
-            
-        self.vector_store.add_skills(skills_with_embeddings)
+        # Keep everything float32 and C-contiguous so BLAS runs single precision
+        embeddings = np.ascontiguousarray(generate_embeddings(texts), dtype=np.float32)
         
-        # 4. Compute Cosine Similarity Matrix
-        # Normalize embeddings
-        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
-        # Avoid division by zero
-        norms[norms == 0] = 1.0
-        normalized_embeddings = embeddings / norms
+        # 3. Compute Cosine Similarity Matrix
+        # Embeddings arrive L2-normalized, so the dot product is the cosine
+        # Symmetric rank-K update: (N, D) @ (D, N) -> (N, N), upper triangle only.
+        # embeddings.T is Fortran-contiguous, so BLAS reads it without a copy.
+        similarity_matrix = ssyrk(1.0, embeddings.T, trans=1, lower=0)
+        # Mirror the strict upper triangle into the lower one (lower is zero)
+        similarity_matrix += np.triu(similarity_matrix, 1).T
         
-        # Matrix multiplication: (N, D) @ (D, N) -> (N, N)
-        similarity_matrix = np.dot(normalized_embeddings, normalized_embeddings.T)
+        # Ensure range [0, 1] (in place, stays float32)
+        np.clip(similarity_matrix, 0.0, 1.0, out=similarity_matrix)
         
-        # Ensure range [0, 1]
-        similarity_matrix = np.clip(similarity_matrix, 0.0, 1.0)
+        # 4. Swap in the Vector Store contents and cached matrix together
+        with self._lock:
+            self._index_skills(skills, fingerprint, embeddings)
+            # Same ordering as DataPreprocessor.create_skill_mapping
+            self._idx_to_skill = [str(s.get('_id', '')) for s in skills]
+            self._cached_matrix = similarity_matrix
         
         return similarity_matrix
     
@@ -113,20 +176,84 @@ class SkillSimilarityCalculator:
         similarities = similarity_matrix[idx]
         
         # Get top K indices (excluding self)
-        # argsort returns indices that sort the array
-        top_indices = np.argsort(similarities)[::-1][1:top_k+1]
+        # argpartition selects the K+1 best in O(N), only those get sorted
+        if top_k + 1 < len(similarities):
+            candidates = np.argpartition(-similarities, top_k)[:top_k + 1]
+        else:
+            candidates = np.arange(len(similarities))
+        top_indices = candidates[np.argsort(-similarities[candidates])]
+        top_indices = top_indices[top_indices != idx][:top_k]
+        
+        # Reverse mapping: the cached list is only valid for the matrix it was
+        # built with; a caller-supplied matrix of equal size may be ordered differently
+        with self._lock:
+            cached = similarity_matrix is self._cached_matrix
+            idx_to_skill = self._idx_to_skill
+        if not cached:
+            idx_to_skill = {v: k for k, v in skill_to_idx.items()}
+        
+        # Gather scores in one vectorized copy instead of K NumPy scalar unboxes
+        top_scores = similarities[top_indices].astype(np.float32).tolist()
+        top_ids = [idx_to_skill[i] for i in top_indices.tolist()]
+        
+        similar_skills = [
+            {'skillId': similar_skill_id, 'similarity': score}
+            for similar_skill_id, score in zip(top_ids, top_scores)
+        ]
+        
+        return similar_skills
+
+    def get_similar_skills_direct(self, skill_id: str, all_skills: List[Dict[str, Any]],
+                                  top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Get top K most similar skills with a single FAISS query.
+        
+        Unlike get_similar_skills this never builds the N x N matrix: the
+        target skill's stored vector is searched against the vector store.
+        
+        Args:
+            skill_id: ID of the target skill
+            all_skills: List of all skills (missing ones are embedded and indexed)
+            top_k: Number of similar skills to return
+            
+        Returns:
+            List of similar skills with similarity scores
+        """
+        # FAISS rejects k <= 0; match get_similar_skills, which returns nothing
+        if top_k <= 0:
+            return []
         
-        # Reverse mapping
-        idx_to_skill = {v: k for k, v in skill_to_idx.items()}
+        skill_ids = {str(s.get('_id', '')) for s in all_skills}
+        if skill_id not in skill_ids:
+            return []
+        
+        fingerprint = self._skills_fingerprint(all_skills)
+        embeddings = self._embed_if_stale(all_skills, fingerprint)
+        
+        with self._lock:
+            # Ensure the vector store holds this skill set
+            self._index_skills(all_skills, fingerprint, embeddings)
+            
+            index = self.vector_store.index
+            query_vector = index.reconstruct(self.vector_store.reverse_map[skill_id])
+            
+            # One extra result so the self match can be dropped
+            k = min(index.ntotal, top_k + 1)
+            results = self.vector_store.search(query_vector, k)
         
         similar_skills = []
-        for top_idx in top_indices:
-            similar_skill_id = idx_to_skill[top_idx]
-            score = similarities[top_idx]
+        seen = {skill_id}
+        for similar_skill_id, score in results:
+            if similar_skill_id in seen or similar_skill_id not in skill_ids:
+                continue
+            seen.add(similar_skill_id)
             similar_skills.append({
                 'skillId': similar_skill_id,
-                'similarity': float(score)
+                # Same [0, 1] range as the similarity matrix
+                'similarity': min(max(score, 0.0), 1.0)
             })
+            if len(similar_skills) == top_k:
+                break
         
         return similar_skills
 
@@ -142,35 +269,33 @@ class SkillSimilarityCalculator:
         Returns:
             List of skill objects
         """
-        if not text:
+        if not text or not text.strip():
             return []
             
-        # Ensure vector store is populated
-        if len(self.vector_store.index) == 0:
-             # Extract text for embeddings
-            texts = [f"{s.get('name', '')} {s.get('description', '')}" for s in all_skills]
-            embeddings = generate_embeddings(texts)
-            
-            skills_with_embeddings = []
-            for i, skill in enumerate(all_skills):
-                skill_copy = skill.copy()
-                skill_copy['embedding'] = embeddings[i]
-                skills_with_embeddings.append(skill_copy)
-                
-            self.vector_store.add_skills(skills_with_embeddings)
-
         # Generate embedding for the query text
         from core.embeddings import generate_embedding
         query_embedding = generate_embedding(text)
         
-        # Search in vector store
-        # results list of (skill_id, distance)
-        results = self.vector_store.search(query_embedding, top_k)
+        fingerprint = self._skills_fingerprint(all_skills)
+        embeddings = self._embed_if_stale(all_skills, fingerprint)
+        
+        with self._lock:
+            # Ensure vector store holds the current skill set
+            self._index_skills(all_skills, fingerprint, embeddings)
+            
+            # Search in vector store
+            # results list of (skill_id, cosine score), best match first.
+            # The shortlist only kicks in for large catalogues (SHORTLIST_MIN_VECTORS),
+            # where the exact scan stops being negligible
+            results = self.vector_store.search(query_embedding, top_k, shortlist=True)
+        
+        # Index skills by ID once instead of scanning the list per result
+        skills_by_id = {str(s.get('_id', '')): s for s in all_skills}
         
         found_skills = []
         for skill_id, score in results:
             # Find the full skill object
-            skill = next((s for s in all_skills if str(s.get('_id', '')) == skill_id), None)
+            skill = skills_by_id.get(skill_id)
             if skill:
                 found_skills.append(skill)
                 
@@ -1,7 +1,8 @@
 import faiss
+import math
 import numpy as np
-import pickle
 import os
+import threading
 
 """
 Vector Store Service
@@ -11,82 +12,297 @@ Stores skill embeddings and retrieves nearest neighbors.
 """
 
 INDEX_FILE = "data/faiss_index.bin"
-ID_MAP_FILE = "data/id_map.pkl"
+BINARY_INDEX_FILE = "data/faiss_binary_index.bin"
+IDS_FILE = "data/skill_ids.npy"
+FINGERPRINT_FILE = "data/skill_fingerprint.txt"
+
+# Above this many vectors the brute-force FP16 index is swapped for IVFPQ
+IVF_THRESHOLD = 10_000
+PQ_M = 32      # Sub-quantizers per vector (bytes per code with 8 bits each)
+PQ_NBITS = 8
+
+# Binary shortlist size per requested result, reranked with the full index vectors
+SHORTLIST_FACTOR = 10
+# Below this many vectors an exact FP16 scan is already cheap, so the
+# shortlist would only cost recall; search() stays exact
+SHORTLIST_MIN_VECTORS = 5_000
+
+
+def _binarize(vectors: np.ndarray) -> np.ndarray:
+    """Pack the sign bit of each dimension into bytes (dimension / 8 per vector)."""
+    return np.packbits(vectors > 0, axis=1)
+
+def _replace_file(path: str, write):
+    """Call write(tmp_path), then atomically rename the result onto `path`."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 class VectorStore:
-    def __init__(self, dimension=768):
+    def __init__(self, dimension=768, nprobe=8):
         """
         Initialize the Vector Store.
         
         Args:
             dimension (int): Dimension of the embeddings (768 for all-mpnet-base-v2)
+            nprobe (int): Number of IVF cells visited per query once the index is IVFPQ
         """
         self.dimension = dimension
-        self.index = faiss.IndexFlatL2(dimension) # L2 distance (Euclidean)
-        self.id_map = {} # Maps FAISS index ID to Skill ID (MongoDB ID)
-        self.reverse_map = {} # Maps Skill ID to FAISS index ID
+        self.nprobe = nprobe
+        self._clear()
+        # Unsaved changes; persisted by flush() instead of on every add
+        self._dirty = False
+        self._lock = threading.Lock()
+        # Background IVFPQ build state; bumping the generation discards a stale build
+        self._generation = 0
+        self._upgrading = False
         
         # Load existing index if available
         self.load()
 
-    def add_skills(self, skills: list):
+    def _clear(self):
+        """Replace the indexes and ID array with empty ones."""
+        # Inner product on L2-normalized vectors == cosine similarity.
+        # Vectors are stored as FP16 (half the RAM and bytes scanned per query)
+        self.index = faiss.IndexScalarQuantizer(
+            self.dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+        )
+        # Sign-bit codes for the Hamming shortlist stage of search()
+        self.index_bin = faiss.IndexBinaryFlat(self.dimension)
+        # Skill ID (MongoDB ID) per FAISS index ID, indexed directly by FAISS id
+        self.ids = np.empty(0, dtype=object)
+        self._reverse_map = None # Skill ID -> FAISS index ID, built on demand
+        # Identifies the skill set indexed here (set by SkillSimilarityCalculator)
+        self.fingerprint = None
+
+    def reset(self):
+        """Remove all vectors, e.g. before re-indexing a changed skill set."""
+        with self._lock:
+            self._clear()
+            self._generation += 1
+            self._upgrading = False
+            self._dirty = True
+
+    @property
+    def reverse_map(self) -> dict:
+        """Map Skill ID to FAISS index ID (built lazily from `ids`)."""
+        if self._reverse_map is None:
+            self._reverse_map = {sid: i for i, sid in enumerate(self.ids)}
+        return self._reverse_map
+
+    def add_vectors(self, ids: list[str], vectors: np.ndarray):
         """
-        Add skills to the FAISS index.
+        Add skill vectors to the FAISS index.
+        
+        Nothing is written to disk here; call flush() to persist.
         
         Args:
-            skills (list): List of skill objects (must contain 'embedding' and '_id')
+            ids (list[str]): Skill IDs, one per row of `vectors`
+            vectors (np.ndarray): Embedding matrix (n_skills x dimension)
         """
-        if not skills:
+        if not ids:
             return
+        
+        # Copy, so normalizing below never modifies the caller's matrix
+        vectors = np.array(vectors, dtype=np.float32)
+        
+        # Normalize in place so inner product scores are cosine similarities
+        faiss.normalize_L2(vectors)
+        
+        with self._lock:
+            # Add to FAISS
+            if not self.index.is_trained:
+                self.index.train(vectors)
+            self.index.add(vectors)
+            self.index_bin.add(_binarize(vectors))
+            
+            # Update ID array (FAISS ids are sequential, so position == FAISS id)
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=object)])
+            self._reverse_map = None
             
-        vectors = np.array([s['embedding'] for s in skills]).astype('float32')
-        ids = [str(s['_id']) for s in skills]
-        
-        # Add to FAISS
-        start_idx = self.index.ntotal
-        self.index.add(vectors)
-        
-        # Update maps
-        for i, skill_id in enumerate(ids):
-            faiss_id = start_idx + i
-            self.id_map[faiss_id] = skill_id
-            self.reverse_map[skill_id] = faiss_id
+            self._maybe_upgrade_index()
+            self._dirty = True
+
+    def flush(self):
+        """Persist the store if it changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.save()
+            self._dirty = False
+
+    def _maybe_upgrade_index(self):
+        """
+        Switch from the FP16 bootstrap index to IVFPQ once the catalogue is large.
+        
+        IVF restricts each query to `nprobe` Voronoi cells and PQ compresses
+        every vector to PQ_M bytes, so search stays sub-linear as skills grow.
+        Training takes seconds, so it runs in a background thread while the
+        FP16 index keeps serving; must be called with self._lock held.
+        """
+        n = self.index.ntotal
+        if n <= IVF_THRESHOLD or self._upgrading or isinstance(self.index, faiss.IndexIVF):
+            return
+        
+        self._upgrading = True
+        vectors = self.index.reconstruct_n(0, n)
+        threading.Thread(
+            target=self._build_ivfpq, args=(vectors, self._generation), daemon=True
+        ).start()
+
+    def _build_ivfpq(self, vectors: np.ndarray, generation: int):
+        """Train an IVFPQ index on `vectors` and swap it in if the store is unchanged."""
+        n = vectors.shape[0]
+        # k-means wants ~39 training points per centroid
+        nlist = max(1, min(max(64, int(4 * math.sqrt(n))), n // 39))
+        
+        try:
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, PQ_M, PQ_NBITS,
+                                     faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.add(vectors)
+        except Exception as e:
+            print(f"Failed to build IVFPQ index: {str(e)}")
+            with self._lock:
+                if generation == self._generation:
+                    self._upgrading = False
+            return
+        
+        with self._lock:
+            if generation != self._generation:
+                # The store was reset while training; this index is stale
+                return
+            # Vectors added during training keep their FAISS ids
+            if self.index.ntotal > n:
+                index.add(self.index.reconstruct_n(n, self.index.ntotal - n))
+            # Keep reconstruct() available for callers that need stored vectors
+            index.make_direct_map()
+            index.nprobe = self.nprobe
             
-        self.save()
+            # Keep the quantizer alive alongside the index
+            self._quantizer = quantizer
+            self.index = index
+            self._upgrading = False
 
-    def search(self, query_vector: np.ndarray, k=5):
+    def search(self, query_vector: np.ndarray, k=5, shortlist: bool = False):
         """
         Search for similar skills.
         
         Args:
             query_vector (np.ndarray): The query embedding
             k (int): Number of results to return
+            shortlist (bool): Allow the approximate binary shortlist + rerank
+                once the store holds SHORTLIST_MIN_VECTORS. Faster, but may
+                miss true neighbours; exact search by default.
             
         Returns:
-            list: List of (skill_id, distance) tuples
+            list: List of (skill_id, score) tuples, higher score = more similar
         """
-        # Reshape to (1, dimension) for FAISS
+        # Reshape to (1, dimension) for FAISS (astype copies, caller's array is untouched)
         vector = query_vector.reshape(1, -1).astype('float32')
+        faiss.normalize_L2(vector)
         
-        distances, indices = self.index.search(vector, k)
+        index = self.index
+        shortlist_size = k * SHORTLIST_FACTOR
+        # IVFPQ is already sub-linear (nprobe cells) and its PQ reconstructions
+        # are too lossy to rerank with, so the shortlist only fronts the FP16 index
+        if (shortlist and not isinstance(index, faiss.IndexIVF)
+                and self.index_bin.ntotal >= max(SHORTLIST_MIN_VECTORS, shortlist_size + 1)):
+            scores, indices = self._search_shortlist(vector, k, shortlist_size)
+        else:
+            scores, indices = index.search(vector, k)
         
+        n_ids = len(self.ids)
         results = []
         for i, idx in enumerate(indices[0]):
-            if idx != -1 and idx in self.id_map:
-                results.append((self.id_map[idx], float(distances[0][i])))
+            if 0 <= idx < n_ids:
+                results.append((self.ids[idx], float(scores[0][i])))
                 
         return results
 
+    def _search_shortlist(self, vector: np.ndarray, k: int, shortlist_size: int):
+        """
+        Two-stage search: Hamming shortlist on sign bits, then exact rerank.
+        
+        Comparing 96-byte binary codes is far cheaper than full inner products,
+        so only the shortlisted candidates are scored against stored vectors.
+        Returns (scores, indices) shaped like index.search output.
+        """
+        _, candidates = self.index_bin.search(_binarize(vector), shortlist_size)
+        candidates = candidates[0][candidates[0] != -1]
+        
+        stored = self.index.reconstruct_batch(candidates)
+        candidate_scores = stored @ vector[0]
+        
+        order = np.argsort(-candidate_scores)[:k]
+        return candidate_scores[order].reshape(1, -1), candidates[order].reshape(1, -1)
+
     def save(self):
-        """Save the index and ID map to disk."""
+        """
+        Save the index, skill IDs and skill set fingerprint to disk.
+        
+        Each file is written to a temporary path and renamed into place. The
+        fingerprint is removed first and written last, so an interrupted or
+        concurrent save leaves no fingerprint and the next start rebuilds.
+        """
         os.makedirs("data", exist_ok=True)
-        faiss.write_index(self.index, INDEX_FILE)
-        with open(ID_MAP_FILE, "wb") as f:
-            pickle.dump((self.id_map, self.reverse_map), f)
+        try:
+            os.remove(FINGERPRINT_FILE)
+        except FileNotFoundError:
+            pass
+        
+        _replace_file(INDEX_FILE, lambda tmp: faiss.write_index(self.index, tmp))
+        _replace_file(BINARY_INDEX_FILE, lambda tmp: faiss.write_index_binary(self.index_bin, tmp))
+        
+        def write_ids(tmp):
+            # Saved as a fixed-width string array, so loading needs no pickle.
+            # Written through a file object so np.save keeps the temp name.
+            with open(tmp, "wb") as f:
+                np.save(f, self.ids.astype(str))
+        _replace_file(IDS_FILE, write_ids)
+        
+        if self.fingerprint is not None:
+            def write_fingerprint(tmp):
+                with open(tmp, "w") as f:
+                    f.write(self.fingerprint)
+            _replace_file(FINGERPRINT_FILE, write_fingerprint)
 
     def load(self):
-        """Load the index and ID map from disk."""
-        if os.path.exists(INDEX_FILE) and os.path.exists(ID_MAP_FILE):
-            self.index = faiss.read_index(INDEX_FILE)
-            with open(ID_MAP_FILE, "rb") as f:
-                self.id_map, self.reverse_map = pickle.load(f)
+        """Load the index, skill IDs and skill set fingerprint from disk."""
+        if os.path.exists(INDEX_FILE) and os.path.exists(IDS_FILE):
+            index = faiss.read_index(INDEX_FILE)
+            # Ignore indexes persisted with the old L2 metric, they will be rebuilt
+            if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                return
+            ids = np.load(IDS_FILE).astype(object)
+            # Files from different saves (or another model) don't describe one
+            # store; start empty so the skill set is re-indexed
+            if index.d != self.dimension or len(ids) != index.ntotal:
+                print("Ignoring inconsistent vector store files, the index will be rebuilt")
+                return
+            if isinstance(index, faiss.IndexIVF):
+                index.make_direct_map()
+                index.nprobe = self.nprobe
+            self.index = index
+            self.ids = ids
+            self._reverse_map = None
+            if os.path.exists(FINGERPRINT_FILE):
+                with open(FINGERPRINT_FILE) as f:
+                    self.fingerprint = f.read().strip() or None
+            
+            if os.path.exists(BINARY_INDEX_FILE):
+                self.index_bin = faiss.read_index_binary(BINARY_INDEX_FILE)
+            if self.index_bin.ntotal != index.ntotal:
+                # Rebuild the sign-bit codes from the stored vectors
+                self.index_bin = faiss.IndexBinaryFlat(self.dimension)
+                if index.ntotal:
+                    self.index_bin.add(_binarize(index.reconstruct_n(0, index.ntotal)))
+            
+            # A large store saved before its IVFPQ build finished is upgraded now
+            with self._lock:
+                self._maybe_upgrade_index()
@@ -12,16 +12,21 @@ Endpoints:
 - GET /recommend/health - Health check endpoint
 """
 
+import os
+
+# Loads the root .env and sets OMP_NUM_THREADS, so it must be imported
+# before numpy, torch and faiss
+from core.runtime import THREADS_PER_WORKER
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import recommend
-import os
-from dotenv import load_dotenv
+import faiss
+import torch
 
-# Load environment variables from .env file if it exists
-# Point to root .env file (parent of recommender directory)
-dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
-load_dotenv(dotenv_path)
+torch.set_num_threads(THREADS_PER_WORKER)
+# FAISS otherwise starts one OpenMP thread per logical core
+faiss.omp_set_num_threads(THREADS_PER_WORKER)
 
 # Initialize FastAPI application
 app = FastAPI(
@@ -11,8 +11,11 @@ Provides endpoints for:
 from fastapi import APIRouter, HTTPException, Body
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
+import asyncio
+import functools
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Add parent directory to path to import core modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -20,6 +23,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.preprocessing import DataPreprocessor
 from core.skill_similarity import SkillSimilarityCalculator
 from core.resource_ranker import ResourceRanker
+from core.embeddings import warmup
+from core.runtime import WORKER_THREADS
 
 # Initialize router
 router = APIRouter(prefix="/recommend", tags=["recommendations"])
@@ -30,6 +35,60 @@ similarity_calculator = SkillSimilarityCalculator()
 resource_ranker = ResourceRanker()
 
 
+# CPU-bound work (embedding, similarity, ranking) runs here, off the event loop.
+# Pool size and the per-worker torch/OpenMP/FAISS thread counts both come from
+# core.runtime so their product stays at about the number of cores.
+_executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+
+async def _run_blocking(fn, *args, **kwargs):
+    """Run a blocking call in the recommender thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+# Seconds between background saves of the vector store
+VECTOR_STORE_FLUSH_INTERVAL = 30
+_flush_task = None
+
+
+async def _flush_vector_store_periodically():
+    """Persist vector store changes off the request path, at most once per interval."""
+    while True:
+        await asyncio.sleep(VECTOR_STORE_FLUSH_INTERVAL)
+        try:
+            await _run_blocking(similarity_calculator.vector_store.flush)
+        except Exception as e:
+            print(f"Error flushing vector store: {str(e)}")
+
+
+@router.on_event("startup")
+async def warmup_model():
+    """
+    Load and warm up the embedding model while the service starts,
+    keeping that latency out of the first /recommend request.
+    Also starts the background vector store flush.
+
+    A failed warmup does not stop the service: the model is then loaded
+    lazily by the first request that needs it.
+    """
+    global _flush_task
+    try:
+        await _run_blocking(warmup)
+    except Exception as e:
+        print(f"Error warming up embedding model, loading lazily instead: {str(e)}")
+    _flush_task = asyncio.create_task(_flush_vector_store_periodically())
+
+
+@router.on_event("shutdown")
+async def flush_vector_store():
+    """Stop the background flush, save pending vector store changes and release the pool."""
+    if _flush_task:
+        _flush_task.cancel()
+    similarity_calculator.vector_store.flush()
+    _executor.shutdown(wait=False)
+
+
 # Pydantic models for request/response validation
 class RecommendationRequest(BaseModel):
     """Request model for getting recommendations."""
@@ -99,7 +158,8 @@ async def get_resource_recommendations(request: RecommendationRequest):
         # Step 3: Build similarity matrix (if we have user data for co-occurrence)
         similarity_matrix = None
         if request.user_skills_data:
-            similarity_matrix = similarity_calculator.build_similarity_matrix(
+            similarity_matrix = await _run_blocking(
+                similarity_calculator.build_similarity_matrix,
                 request.skills,
                 request.user_skills_data
             )
@@ -110,8 +170,9 @@ async def get_resource_recommendations(request: RecommendationRequest):
             print(f"Processing goal text: {request.goal_text}")
             # Find skills similar to the goal text
             # We treat the goal text as a "skill" for vector search
-            similar_to_goal = similarity_calculator.find_similar_skills_by_text(
-                request.goal_text, 
+            similar_to_goal = await _run_blocking(
+                similarity_calculator.find_similar_skills_by_text,
+                request.goal_text,
                 request.skills, 
                 top_k=3
             )
@@ -130,7 +191,8 @@ async def get_resource_recommendations(request: RecommendationRequest):
         resource_features = preprocessor.prepare_resource_features(request.resources)
         
         # Step 5: Rank resources using local engine
-        ranked_resources = resource_ranker.rank_resources(
+        ranked_resources = await _run_blocking(
+            resource_ranker.rank_resources,
             resources=request.resources,
             user_skills=request.user_skills,
             skills_to_improve=skills_to_improve,
@@ -192,10 +254,8 @@ async def get_similar_skills(request: SimilarSkillsRequest):
     """
     Find skills similar to a given skill.
     
-    Uses multiple similarity metrics:
-    - Category matching
-    - Keyword similarity (Jaccard)
-    - Co-occurrence patterns
+    Uses cosine similarity between skill embeddings, searched directly
+    in the vector store for the target skill.
     
     Args:
         request: SimilarSkillsRequest with target skill and system skills
@@ -206,34 +266,27 @@ async def get_similar_skills(request: SimilarSkillsRequest):
         - target_skill: Information about the target skill
     """
     try:
-        # Build similarity matrix
-        similarity_matrix = similarity_calculator.build_similarity_matrix(
-            request.skills,
-            request.user_skills_data or []
-        )
-        
-        # Create skill mapping
-        skill_mapping = preprocessor.create_skill_mapping(request.skills)
-        
-        # Find similar skills
-        similar_skills = similarity_calculator.get_similar_skills(
+        # Find similar skills with a direct vector search (no N x N matrix)
+        similar_skills = await _run_blocking(
+            similarity_calculator.get_similar_skills_direct,
             skill_id=request.skill_id,
-            similarity_matrix=similarity_matrix,
-            skill_to_idx=skill_mapping,
+            all_skills=request.skills,
             top_k=request.top_k
         )
         
+        # Index skills by ID once for the lookups below
+        skills_by_id = {str(skill.get('_id', '')): skill for skill in request.skills}
+        
         # Find target skill info
         target_skill = None
-        for skill in request.skills:
-            if str(skill.get('_id', '')) == request.skill_id:
-                target_skill = {
-                    'id': str(skill.get('_id', '')),
-                    'name': skill.get('name', ''),
-                    'category': skill.get('category', ''),
-                    'description': skill.get('description', '')
-                }
-                break
+        skill = skills_by_id.get(request.skill_id)
+        if skill:
+            target_skill = {
+                'id': request.skill_id,
+                'name': skill.get('name', ''),
+                'category': skill.get('category', ''),
+                'description': skill.get('description', '')
+            }
         
         if not target_skill:
             raise HTTPException(
@@ -245,15 +298,14 @@ async def get_similar_skills(request: SimilarSkillsRequest):
         formatted_similar = []
         for sim_skill in similar_skills:
             skill_id = sim_skill['skillId']
-            for skill in request.skills:
-                if str(skill.get('_id', '')) == skill_id:
-                    formatted_similar.append({
-                        'id': skill_id,
-                        'name': skill.get('name', ''),
-                        'category': skill.get('category', ''),
-                        'similarity': sim_skill['similarity']
-                    })
-                    break
+            skill = skills_by_id.get(skill_id)
+            if skill:
+                formatted_similar.append({
+                    'id': skill_id,
+                    'name': skill.get('name', ''),
+                    'category': skill.get('category', ''),
+                    'similarity': sim_skill['similarity']
+                })
         
         return {
             'target_skill': target_skill,
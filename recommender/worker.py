@@ -125,6 +125,9 @@ def process_job(job_data):
         
         print(f"Job completed for IDP: {idp_id}")
         
+        # Persist any vector store changes now that the job is done
+        similarity_calculator.vector_store.flush()
+        
     except Exception as e:
         print(f"Error processing job: {e}")
         # Optionally update IDP status to 'failed'